@@ -1,41 +1,117 @@
 # app/auth.py
 import os
-import uuid
+import time
+import asyncio
+import secrets
+import base64
+import hashlib
+import hmac
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Depends, HTTPException, status, WebSocket, WebSocketException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+import orjson
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
+from argon2 import PasswordHasher, Type
+from argon2.exceptions import VerificationError, InvalidHash
+from cachetools import TTLCache
 from .store_sql import store
 
-# Password hashing context - using Argon2
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2id parameters (OWASP minimum: 19 MiB, t=2, p=1). Pinned explicitly so
+# login latency is bounded and predictable across library upgrades.
+ARGON2_MEMORY_KIB = int(os.environ.get("ARGON2_MEMORY_KIB", "19456"))
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "2"))
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "1"))
+
+# Password hasher - Argon2id via argon2-cffi directly (no passlib dispatch)
+_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_KIB,
+    parallelism=ARGON2_PARALLELISM,
+    type=Type.ID,
+)
+
+# Verified against when a login names an unknown user, so that miss path costs
+# the same Argon2 verify as a wrong password (no username-enumeration timing)
+DUMMY_PASSWORD_HASH = _hasher.hash(secrets.token_urlsafe(32))
+
+# Argon2 is pure CPU work; run it off the event loop on a small bounded pool.
+# The pool size also caps peak hashing memory at max_workers * memory_cost.
+_pw_executor = ThreadPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 1),
+    thread_name_prefix="argon2",
+)
 
 # JWT Configuration
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key-change-in-production-min-32-chars")
+# Key bytes and algorithm list are passed to PyJWT as-is on every call
+_SECRET_BYTES = SECRET_KEY.encode("utf-8")
 if not SECRET_KEY or SECRET_KEY == "dev-secret-key-change-in-production-min-32-chars":
     import warnings
     warnings.warn("Using default SECRET_KEY. Set SECRET_KEY environment variable for production!", UserWarning)
-elif len(SECRET_KEY) < 32:
-    raise ValueError("SECRET_KEY must be at least 32 characters long")
+elif len(_SECRET_BYTES) < 32:
+    raise ValueError("SECRET_KEY must be at least 32 bytes long (UTF-8 encoded)")
 ALGORITHM = "HS256"
+_ALGS = [ALGORITHM]
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# Token minting is plain HS256: the header never changes and the key is fixed,
+# so encode both once instead of letting jwt.encode rebuild them per token.
+_JWT_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
 # Security scheme for HTTP Bearer tokens
 security = HTTPBearer()
 
+# Verified JWT (payload, exp) pairs keyed by sha256(token), so a bearer token is
+# only cryptographically verified once per TTL window. Failed tokens are never cached.
+JWT_CACHE_TTL_SECONDS = 30
+_jwt_cache: TTLCache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL_SECONDS)
+
+# Authenticated user lookups keyed by user_id, to skip the DB round trip on
+# every protected request.
+USER_CACHE_TTL_SECONDS = 60
+_user_cache: TTLCache = TTLCache(maxsize=5000, ttl=USER_CACHE_TTL_SECONDS)
+
+
+def _verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return _hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHash):
+        return False
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash (runs in the hashing thread pool)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pw_executor, _verify_password_sync, plain_password, hashed_password)
+
+
+async def get_password_hash(password: str) -> str:
+    """Hash a password (runs in the hashing thread pool)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pw_executor, _hasher.hash, password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check whether a stored hash was made with different Argon2 parameters."""
+    try:
+        return _hasher.check_needs_rehash(hashed_password)
+    except InvalidHash:
+        return False
+
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    return pwd_context.hash(password)
+def _encode_jwt(claims: dict) -> str:
+    """Sign claims as an HS256 JWT using the pre-encoded header and key."""
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url(orjson.dumps(claims))
+    signature = hmac.new(_SECRET_BYTES, signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url(signature)).decode("ascii")
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -48,13 +124,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({
-        "exp": expire,
-        "iat": now,  # Issued at
-        "jti": str(uuid.uuid4()),  # JWT ID - ensures token uniqueness
+        "exp": int(expire.timestamp()),
+        "iat": int(now.timestamp()),  # Issued at
+        "jti": secrets.token_hex(16),  # JWT ID - ensures token uniqueness
         "type": "access"
     })
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return _encode_jwt(to_encode)
 
 
 def create_refresh_token(data: dict) -> str:
@@ -63,19 +138,68 @@ def create_refresh_token(data: dict) -> str:
     now = datetime.now(timezone.utc)
     expire = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({
-        "exp": expire,
-        "iat": now,  # Issued at
-        "jti": str(uuid.uuid4()),  # JWT ID - ensures token uniqueness
+        "exp": int(expire.timestamp()),
+        "iat": int(now.timestamp()),  # Issued at
+        "jti": secrets.token_hex(16),  # JWT ID - ensures token uniqueness
         "type": "refresh"
     })
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return _encode_jwt(to_encode)
+
+
+def mint_token_pair(user_id: str) -> Tuple[str, str]:
+    """
+    Create an (access, refresh) token pair for a user in one pass.
+    Both tokens share the same issued-at time.
+    """
+    iat = int(time.time())
+    access_token = _encode_jwt({
+        "sub": user_id,
+        "exp": iat + ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "iat": iat,
+        "jti": secrets.token_hex(16),
+        "type": "access",
+    })
+    refresh_token = _encode_jwt({
+        "sub": user_id,
+        "exp": iat + REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        "iat": iat,
+        "jti": secrets.token_hex(16),
+        "type": "refresh",
+    })
+    return access_token, refresh_token
+
+
+async def _cached_get_user(user_id: str) -> Optional[dict]:
+    """Get a user by id, serving repeated lookups from the user cache."""
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = await store.get_user(user_id)
+        if user is not None:
+            _user_cache[user_id] = user
+    return user
+
+
+def invalidate_user(user_id: str) -> None:
+    """Drop a cached user so the next lookup hits the store."""
+    _user_cache.pop(user_id, None)
 
 
 def decode_token(token: str) -> dict:
-    """Decode and validate a JWT token."""
+    """Decode and validate a JWT token (verified payloads are cached briefly)."""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    entry = _jwt_cache.get(key)
+    if entry is not None:
+        # Re-check expiry so a cached token never outlives its exp claim;
+        # a plain float compare instead of PyJWT's datetime-based checks
+        if entry[1] > time.time():
+            # Each caller gets its own copy, so no one can edit the cached claims
+            return dict(entry[0])
+        _jwt_cache.pop(key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _SECRET_BYTES, algorithms=_ALGS)
+        # Tokens without exp get 0.0 and are therefore never served from cache
+        _jwt_cache[key] = (dict(payload), float(payload.get("exp", 0)))
         return payload
     except InvalidTokenError:
         raise HTTPException(
@@ -85,15 +209,18 @@ def decode_token(token: str) -> dict:
         )
 
 
-async def get_current_user(
-    request: Request,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> dict:
+# WebSocket close reasons for failures raised by _authenticate
+_WS_AUTH_REASONS = {
+    "Could not validate credentials": "Invalid authentication token",
+    "User not found": "User not found. Please log in again (database may have been reset).",
+}
+
+
+async def _authenticate(token: str) -> dict:
     """
-    Dependency to get the current authenticated user from JWT token.
-    Used in route handlers.
+    Resolve an access token to its user: decode, check type, look up user.
+    Shared by the HTTP and WebSocket auth paths; raises HTTPException (401).
     """
-    token = credentials.credentials
     payload = decode_token(token)
 
     # Check token type
@@ -110,15 +237,34 @@ async def get_current_user(
             detail="Invalid token payload",
         )
 
-    user = await store.get_user(user_id)
+    user = await _cached_get_user(user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
 
+    return user
+
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> dict:
+    """
+    Dependency to get the current authenticated user from JWT token.
+    Used in route handlers. The resolved user is memoized on request.state.user,
+    so repeated resolution within one request authenticates only once.
+    """
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+
+    user = await _authenticate(credentials.credentials)
+
+    request.state.user = user
     # Store user_id in request state for rate limiting
-    request.state.user_id = user_id
+    request.state.user_id = user["id"]
 
     return user
 
@@ -126,7 +272,8 @@ async def get_current_user(
 async def get_current_user_websocket(websocket: WebSocket) -> dict:
     """
     Extract and validate user from WebSocket token.
-    Used in WebSocket endpoint.
+    Used in WebSocket endpoint. Authentication runs once per connection;
+    the resolved user is kept on websocket.state.user for the session.
     """
     # Get token from query parameter or header
     token = None
@@ -147,32 +294,12 @@ async def get_current_user_websocket(websocket: WebSocket) -> dict:
         )
 
     try:
-        payload = decode_token(token)
-
-        # Check token type
-        if payload.get("type") != "access":
-            raise WebSocketException(
-                code=status.WS_1008_POLICY_VIOLATION,
-                reason="Invalid token type"
-            )
-
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise WebSocketException(
-                code=status.WS_1008_POLICY_VIOLATION,
-                reason="Invalid token payload"
-            )
-
-        user = await store.get_user(user_id)
-        if user is None:
-            raise WebSocketException(
-                code=status.WS_1008_POLICY_VIOLATION,
-                reason="User not found. Please log in again (database may have been reset)."
-            )
-
-        return user
-    except HTTPException:
+        user = await _authenticate(token)
+    except HTTPException as e:
         raise WebSocketException(
             code=status.WS_1008_POLICY_VIOLATION,
-            reason="Invalid authentication token"
+            reason=_WS_AUTH_REASONS.get(e.detail, e.detail)
         )
+
+    websocket.state.user = user
+    return user
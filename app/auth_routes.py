@@ -5,10 +5,12 @@ from .store_sql import store
 from .auth import (
     get_password_hash,
     verify_password,
-    create_access_token,
-    create_refresh_token,
+    password_needs_rehash,
+    DUMMY_PASSWORD_HASH,
+    mint_token_pair,
     decode_token,
     get_current_user,
+    invalidate_user,
 )
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -29,7 +31,7 @@ async def signup(user_data: UserCreate):
         )
 
     # Hash password and create user
-    password_hash = get_password_hash(user_data.password)
+    password_hash = await get_password_hash(user_data.password)
     try:
         user = await store.create_user(user_data.username, password_hash, user_data.full_name)
         return UserResponse(**user)
@@ -49,6 +51,8 @@ async def login(credentials: UserLogin):
     # Get user by username
     user = await store.get_user_by_username(credentials.username)
     if not user:
+        # Spend the same (off-loop) Argon2 time as a real check before rejecting
+        await verify_password(credentials.password, DUMMY_PASSWORD_HASH)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -56,16 +60,22 @@ async def login(credentials: UserLogin):
         )
 
     # Verify password
-    if not verify_password(credentials.password, user["password_hash"]):
+    if not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Transparently upgrade hashes made with older Argon2 parameters
+    if password_needs_rehash(user["password_hash"]):
+        new_hash = await get_password_hash(credentials.password)
+        await store.update_password_hash(user["id"], new_hash)
+        # The stored user row changed, so drop its cached copy
+        invalidate_user(user["id"])
+
     # Create tokens
-    access_token = create_access_token(data={"sub": user["id"]})
-    refresh_token = create_refresh_token(data={"sub": user["id"]})
+    access_token, refresh_token = mint_token_pair(user["id"])
 
     return Token(
         access_token=access_token,
@@ -106,8 +116,7 @@ async def refresh_token(token_data: TokenRefresh):
             )
 
         # Create new tokens
-        access_token = create_access_token(data={"sub": user_id})
-        refresh_token = create_refresh_token(data={"sub": user_id})
+        access_token, refresh_token = mint_token_pair(user_id)
 
         return Token(
             access_token=access_token,
@@ -2,12 +2,14 @@
 """
 Structured JSON logging configuration.
 """
-import json
 import logging
+import os
 import sys
-from datetime import datetime
+import time
 from typing import Any, Dict
 
+import orjson
+
 
 class JSONFormatter(logging.Formatter):
     """Custom formatter that outputs JSON logs."""
@@ -15,7 +17,8 @@ class JSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON."""
         log_data: Dict[str, Any] = {
-            "timestamp": datetime.now().isoformat() + "Z",
+            # record.created is already set by logging; no extra clock read
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -32,14 +35,21 @@ class JSONFormatter(logging.Formatter):
         if hasattr(record, "extra_fields"):
             log_data.update(record.extra_fields)
 
-        return json.dumps(log_data)
+        # default=str keeps non-JSON extra fields from breaking the log line
+        return orjson.dumps(log_data, default=str).decode()
 
 
 def setup_logging():
     """Configure structured JSON logging."""
     # Get root logger
+    # LOG_LEVEL=WARNING drops the per-message/per-connection INFO records;
+    # the hot paths check isEnabledFor before building them
+    level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level)
 
     # Remove existing handlers
     logger.handlers.clear()
@@ -50,8 +60,8 @@ def setup_logging():
     logger.addHandler(handler)
 
     # Set specific loggers
-    logging.getLogger("pneumatic").setLevel(logging.INFO)
-    logging.getLogger("uvicorn").setLevel(logging.INFO)
-    logging.getLogger("fastapi").setLevel(logging.INFO)
+    logging.getLogger("pneumatic").setLevel(level)
+    logging.getLogger("uvicorn").setLevel(level)
+    logging.getLogger("fastapi").setLevel(level)
 
     return logger
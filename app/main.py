@@ -1,16 +1,21 @@
 # app/main.py
 import os
+import time
 import logging
+from contextlib import asynccontextmanager
+import orjson
 from fastapi import FastAPI, WebSocket, status, WebSocketDisconnect, WebSocketException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, Response
-from .routes import router
+from sqlalchemy import text
+from .routes import router, drain_background_broadcasts
 from .auth_routes import router as auth_router
 from .websockets import manager
 from .store_sql import store  # async SQL store
 from .schemas import MessageCreate
-from .db import init_db, engine
+from .models import is_uuid
+from .db import init_db, reset_db, engine
 from .auth import get_current_user_websocket
 from .metrics import metrics
 from .logging_config import setup_logging
@@ -21,7 +26,24 @@ from .rate_limit import RateLimitMiddleware, RateLimiter
 setup_logging()
 logger = logging.getLogger("pneumatic")
 
-app = FastAPI(title="Pneumatic Chat - Secure")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown: the single place the schema is initialized."""
+    logger.info("Starting Pneumatic Chat application", extra={"extra_fields": {"event": "startup"}})
+    if os.environ.get("RESET_DEV_DB") == "1":
+        # Dev only: drop and recreate the schema on every start
+        await reset_db()
+    else:
+        # Ensure database tables exist (creates if missing, preserves existing data)
+        await init_db()
+    logger.info("Database initialized", extra={"extra_fields": {"event": "db_init"}})
+    yield
+    # Let broadcasts spawned by POST /messages finish before the loop goes away
+    await drain_background_broadcasts()
+
+
+app = FastAPI(title="Pneumatic Chat - Secure", lifespan=lifespan)
 
 # Setup OpenTelemetry tracing (must be before other middleware)
 setup_tracing(app, engine)
@@ -70,6 +92,12 @@ async def health_check():
     return {"status": "healthy"}
 
 
+# Readiness is re-probed at most this often; load balancer polls in between reuse the result
+_READY_CACHE_SECONDS = 2.0
+# (monotonic time of last probe, database reachable?)
+_ready_cache = (0.0, False)
+
+
 @app.get("/ready")
 async def readiness_check():
     """
@@ -77,20 +105,26 @@ async def readiness_check():
     Returns 200 if the service is ready to accept traffic.
     Used by load balancers to determine if the instance can handle requests.
     """
-    try:
-        # Check database connectivity
-        # Simple check: try to query the database
-        from sqlalchemy import text
-        from .db import engine
-        async with engine.begin() as conn:
-            await conn.execute(text("SELECT 1"))
+    global _ready_cache
+    checked_at, ready = _ready_cache
+    now = time.monotonic()
+    if now - checked_at >= _READY_CACHE_SECONDS:
+        try:
+            # Check database connectivity
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            ready = True
+        except Exception:
+            ready = False
+        _ready_cache = (now, ready)
+
+    if ready:
         return {"status": "ready"}
-    except Exception as e:
-        return Response(
-            content='{"status": "not ready", "error": "database unavailable"}',
-            status_code=503,
-            media_type="application/json"
-        )
+    return Response(
+        content='{"status": "not ready", "error": "database unavailable"}',
+        status_code=503,
+        media_type="application/json"
+    )
 
 
 @app.get("/metrics")
@@ -103,14 +137,117 @@ async def metrics_endpoint():
     return Response(content=metrics_text, media_type="text/plain")
 
 
-@app.on_event("startup")
-async def on_startup():
-    logger.info("Starting Pneumatic Chat application", extra={"extra_fields": {"event": "startup"}})
-    # Ensure database tables exist (creates if missing, preserves existing data)
-    await init_db()
-    logger.info("Database initialized", extra={"extra_fields": {"event": "db_init"}})
+async def _send_json(websocket: WebSocket, user_id: str, data: dict):
+    """Queue a JSON text frame encoded with orjson on the connection's outbox."""
+    await manager.send_frame(user_id, websocket, orjson.dumps(data).decode())
+
+
+def _error_frame(reason: str) -> str:
+    return orjson.dumps({"type": "error", "reason": reason}).decode()
+
+
+# Constant error frames, encoded once at import instead of per send
+_CONV_ID_REQUIRED_ERR = _error_frame("conversation_id required")
+_CONV_NOT_FOUND_ERR = _error_frame("conversation not found")
+_NOT_A_MEMBER_ERR = _error_frame("not a member of this conversation")
+_INVALID_SHAPE_ERR = _error_frame("invalid message shape")
+_UNKNOWN_TYPE_ERR = _error_frame("unknown type")
+
+# Keys a "message" frame must carry (sender_id comes from the authenticated user)
+_MESSAGE_KEYS = frozenset(("message_id", "conversation_id", "content"))
+
+
+async def _handle_join(websocket: WebSocket, user_id: str, data: dict):
+    """Handle a "join" frame: confirm the user may follow a conversation."""
+    conv_id = data.get("conversation_id")
+    if not conv_id:
+        await manager.send_frame(user_id, websocket, _CONV_ID_REQUIRED_ERR)
+        return
+
+    # Verify user is a member of the conversation
+    conv = await store.get_conversation_cached(conv_id) if is_uuid(conv_id) else None
+    if conv is None:
+        await manager.send_frame(user_id, websocket, _CONV_NOT_FOUND_ERR)
+        return
+
+    if user_id not in conv["members"]:
+        await manager.send_frame(user_id, websocket, _NOT_A_MEMBER_ERR)
+        return
+
+    await _send_json(websocket, user_id, {"type": "joined", "conversation_id": conv_id})
 
 
+async def _handle_message(websocket: WebSocket, user_id: str, data: dict):
+    """Handle a "message" frame: validate, persist and broadcast it."""
+    # validate message shape by hand: three required string fields is all
+    # MessageCreate checks, so a full pydantic validation pass is pure overhead
+    if not _MESSAGE_KEYS.issubset(data):
+        await manager.send_frame(user_id, websocket, _INVALID_SHAPE_ERR)
+        return
+
+    message_id = data["message_id"]
+    conversation_id = data["conversation_id"]
+    content = data["content"]
+    if not (type(message_id) is str and type(conversation_id) is str and type(content) is str):
+        await manager.send_frame(user_id, websocket, _INVALID_SHAPE_ERR)
+        return
+    if not is_uuid(message_id):
+        await manager.send_frame(user_id, websocket, _INVALID_SHAPE_ERR)
+        return
+    if not is_uuid(conversation_id):
+        await manager.send_frame(user_id, websocket, _CONV_NOT_FOUND_ERR)
+        return
+
+    mc = MessageCreate.construct(
+        message_id=message_id,
+        sender_id=user_id,  # Enforce authenticated user as sender
+        conversation_id=conversation_id,
+        content=content,
+    )
+
+    # save_message is async now — await it
+    try:
+        saved = await store.save_message(mc)
+    except (KeyError, PermissionError) as e:
+        logger.error("Message save error: %s", e, exc_info=True)
+        await _send_json(websocket, user_id, {"type": "error", "reason": str(e)})
+        return
+    except Exception as e:
+        logger.error("Unexpected error saving message: %s", e, exc_info=True)
+        await _send_json(websocket, user_id, {"type": "error", "reason": f"failed to save message: {str(e)}"})
+        return
+
+    # broadcast to members; the frame is encoded once here and reused per recipient
+    try:
+        frame = orjson.dumps({"type": "message", "message": saved}).decode()
+        await manager.broadcast_text_to_conversation(saved["conversation_id"], frame)
+    except Exception as e:
+        logger.error("Error broadcasting message: %s", e, exc_info=True)
+        # Don't fail the message send if broadcast fails, but log it
+        await _send_json(websocket, user_id, {"type": "error", "reason": f"message saved but broadcast failed: {str(e)}"})
+        return
+
+    # Track message metric
+    metrics.increment_message_sent()
+    # Only build the structured payload if INFO records are actually emitted
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Message sent via WebSocket",
+            extra={"extra_fields": {
+                "user_id": user_id,
+                "conversation_id": saved["conversation_id"],
+                "message_id": saved["message_id"],
+                "event": "message_sent"
+            }}
+        )
+
+
+# Frame type -> handler(websocket, user_id, data)
+_HANDLERS = {
+    "join": _handle_join,
+    "message": _handle_message,
+}
+
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -126,104 +263,37 @@ async def websocket_endpoint(websocket: WebSocket):
 
         await manager.connect(user_id, websocket)
         metrics.increment_websocket_connection()
-        logger.info(
-            "WebSocket connection established",
-            extra={"extra_fields": {"user_id": user_id, "event": "websocket_connect"}}
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "WebSocket connection established",
+                extra={"extra_fields": {"user_id": user_id, "event": "websocket_connect"}}
+            )
 
         try:
             while True:
-                data = await websocket.receive_json()
+                data = orjson.loads(await websocket.receive_text())
                 if not isinstance(data, dict):
                     continue
-                typ = data.get("type")
-                if typ == "join":
-                    conv_id = data.get("conversation_id")
-                    if not conv_id:
-                        await websocket.send_json({"type": "error", "reason": "conversation_id required"})
-                        continue
-
-                    # Verify user is a member of the conversation
-                    conv = await store.get_conversation(conv_id)
-                    if not conv:
-                        await websocket.send_json({"type": "error", "reason": "conversation not found"})
-                        continue
-
-                    if user_id not in conv["members"]:
-                        await websocket.send_json({"type": "error", "reason": "not a member of this conversation"})
-                        continue
-
-                    await websocket.send_json({"type": "joined", "conversation_id": conv_id})
-
-                elif typ == "message":
-                    # validate message shape
-                    try:
-                        mc = MessageCreate(
-                            message_id=data["message_id"],
-                            sender_id=user_id,  # Enforce authenticated user as sender
-                            conversation_id=data["conversation_id"],
-                            content=data["content"],
-                        )
-                    except KeyError as e:
-                        logger.error(f"Invalid message shape: {e}", exc_info=True)
-                        await websocket.send_json({"type": "error", "reason": "invalid message shape"})
-                        continue
-                    except Exception as e:
-                        logger.error(f"Error creating MessageCreate: {e}", exc_info=True)
-                        await websocket.send_json({"type": "error", "reason": f"invalid message: {str(e)}"})
-                        continue
-
-                    # save_message is async now — await it
-                    try:
-                        saved = await store.save_message(mc)
-                    except (KeyError, PermissionError) as e:
-                        logger.error(f"Message save error: {e}", exc_info=True)
-                        await websocket.send_json({"type": "error", "reason": str(e)})
-                        continue
-                    except Exception as e:
-                        logger.error(f"Unexpected error saving message: {e}", exc_info=True)
-                        await websocket.send_json({"type": "error", "reason": f"failed to save message: {str(e)}"})
-                        continue
-
-                    # broadcast to members (manager.broadcast_to_conversation is async)
-                    try:
-                        payload = {"type": "message", "message": saved}
-                        await manager.broadcast_to_conversation(saved["conversation_id"], payload)
-                    except Exception as e:
-                        logger.error(f"Error broadcasting message: {e}", exc_info=True)
-                        # Don't fail the message send if broadcast fails, but log it
-                        await websocket.send_json({"type": "error", "reason": f"message saved but broadcast failed: {str(e)}"})
-                        continue
-
-                    # Track message metric
-                    metrics.increment_message_sent()
-                    logger.info(
-                        "Message sent via WebSocket",
-                        extra={"extra_fields": {
-                            "user_id": user_id,
-                            "conversation_id": saved["conversation_id"],
-                            "message_id": saved["message_id"],
-                            "event": "message_sent"
-                        }}
-                    )
-                else:
-                    await websocket.send_json({"type": "error", "reason": "unknown type"})
+                handler = _HANDLERS.get(data.get("type"))
+                if handler is None:
+                    await manager.send_frame(user_id, websocket, _UNKNOWN_TYPE_ERR)
+                    continue
+                await handler(websocket, user_id, data)
         except WebSocketDisconnect:
-            # client disconnected; ensure we remove the connection and exit cleanly
-            logger.info(f"WebSocket disconnected by client for user {user_id}")
-            await manager.disconnect(user_id, websocket)
-            return
+            # client disconnected; cleanup happens below
+            logger.info("WebSocket disconnected by client for user %s", user_id)
         except Exception as e:
             # Log the error before disconnecting
-            logger.error(f"WebSocket error for user {user_id}: {e}", exc_info=True)
-            # ensure we remove the connection on any other error
+            logger.error("WebSocket error for user %s: %s", user_id, e, exc_info=True)
             try:
-                await websocket.send_json({"type": "error", "reason": f"server error: {str(e)}"})
+                await _send_json(websocket, user_id, {"type": "error", "reason": f"server error: {str(e)}"})
             except Exception:
                 pass
-            await manager.disconnect(user_id, websocket)
             # Don't re-raise - just log and disconnect cleanly
-            return
+        finally:
+            # Single cleanup point for every exit from the receive loop
+            await manager.disconnect(user_id, websocket)
+        return
     except WebSocketException as e:
         # Authentication failed
         try:
@@ -5,31 +5,50 @@ Tracks WebSocket connections and message counts.
 """
 import time
 from typing import Dict
-from collections import deque
-from threading import Lock
 
 class Metrics:
     """Simple in-memory metrics collector."""
 
     def __init__(self):
-        self.lock = Lock()
-        # Counters
+        # Counters are only updated from the event loop thread, so plain
+        # increments need no lock
         self.websocket_connections_total = 0
         self.messages_sent_total = 0
 
-        # Message rate tracking (last 60 seconds)
-        self.message_timestamps = deque(maxlen=1000)  # Store timestamps of last 1000 messages
+        # Message rate tracking (last 60 seconds): one bucket per second in a
+        # ring, plus a running total so neither sends nor scrapes scan history
+        self.window_seconds = 60
+        self.buckets = [0] * self.window_seconds
+        self.bucket_ts = int(time.monotonic())
+        self.running = 0
 
     def increment_websocket_connection(self):
         """Increment total WebSocket connections counter."""
-        with self.lock:
-            self.websocket_connections_total += 1
+        self.websocket_connections_total += 1
+
+    def _advance(self, now: int):
+        """Expire the buckets for every second elapsed since the last update."""
+        elapsed = now - self.bucket_ts
+        if elapsed <= 0:
+            return
+        if elapsed >= self.window_seconds:
+            self.buckets = [0] * self.window_seconds
+            self.running = 0
+        else:
+            for second in range(self.bucket_ts + 1, now + 1):
+                idx = second % self.window_seconds
+                self.running -= self.buckets[idx]
+                self.buckets[idx] = 0
+        self.bucket_ts = now
 
     def increment_message_sent(self):
-        """Increment message counter and record timestamp."""
-        with self.lock:
-            self.messages_sent_total += 1
-            self.message_timestamps.append(time.time())
+        """Increment message counter and count it in the current second's bucket."""
+        self.messages_sent_total += 1
+        now = int(time.monotonic())
+        if now != self.bucket_ts:
+            self._advance(now)
+        self.buckets[now % self.window_seconds] += 1
+        self.running += 1
 
     def get_active_connections(self, connection_manager) -> int:
         """Get current number of active WebSocket connections."""
@@ -37,11 +56,8 @@ class Metrics:
 
     def get_messages_per_second(self) -> float:
         """Calculate messages per second over the last 60 seconds."""
-        with self.lock:
-            now = time.time()
-            # Count messages in last 60 seconds
-            recent_messages = sum(1 for ts in self.message_timestamps if now - ts <= 60)
-            return recent_messages / 60.0 if recent_messages > 0 else 0.0
+        self._advance(int(time.monotonic()))
+        return self.running / self.window_seconds
 
     def get_metrics_prometheus(self, connection_manager) -> str:
         """
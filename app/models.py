@@ -1,13 +1,72 @@
 # app/models.py
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import declarative_base
+import os
+import time
 import uuid
 from datetime import datetime, timezone
 
 Base = declarative_base()
 
+# Random bytes for ids are drawn from the OS in 4 KiB-ish blocks and handed out
+# 10 at a time, so one getrandom() call covers ~400 ids
+_RAND_BLOCK_SIZE = 4090
+_rand_block = b""
+_rand_pos = 0
+_rand_pid = 0
+
+
+def _random_10_bytes() -> bytes:
+    global _rand_block, _rand_pos, _rand_pid
+    # Refill after fork too, so worker processes never share a block
+    if _rand_pos + 10 > len(_rand_block) or _rand_pid != os.getpid():
+        _rand_block = os.urandom(_RAND_BLOCK_SIZE)
+        _rand_pos = 0
+        _rand_pid = os.getpid()
+    chunk = _rand_block[_rand_pos:_rand_pos + 10]
+    _rand_pos += 10
+    return chunk
+
+
 def gen_uuid():
-    return str(uuid.uuid4())
+    # UUIDv7 (RFC 9562): 48-bit millisecond timestamp, then random bits, so new
+    # keys land at the right-hand edge of the primary-key B-tree
+    ts_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(_random_10_bytes(), "big")
+    value = (
+        (ts_ms & 0xFFFFFFFFFFFF) << 80
+        | 0x7 << 76
+        | (rand >> 68) << 64
+        | 0b10 << 62
+        | (rand & 0x3FFFFFFFFFFFFFFF)
+    )
+    return str(uuid.UUID(int=value))
+
+
+def is_uuid(value) -> bool:
+    """True if value parses as a UUID, i.e. could name a row on any backend."""
+    try:
+        uuid.UUID(value)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return True
+
+
+class UUIDString(sa.types.TypeDecorator):
+    """
+    UUID exposed to Python as its 36-char string form.
+    Stored as PostgreSQL's native 16-byte uuid type; String(36) elsewhere.
+    Ids from clients are checked with is_uuid at the API boundary; a malformed
+    id that reaches the database is rejected by the driver.
+    """
+    impl = sa.String(length=36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(sa.String(length=36))
 
 def utc_now():
     # Return naive datetime to match column definition (timezone=False)
@@ -16,26 +75,39 @@ def utc_now():
 
 class User(Base):
     __tablename__ = "users"
-    id = sa.Column(sa.String(length=36), primary_key=True, default=gen_uuid)
-    username = sa.Column(sa.String(length=150), nullable=False, unique=True)
+    id = sa.Column(UUIDString(), primary_key=True, default=gen_uuid)
+    username = sa.Column(sa.String(length=150), nullable=False, unique=True, index=True)
     full_name = sa.Column(sa.String(length=255), nullable=True)
     password_hash = sa.Column(sa.String(length=255), nullable=False)
 
 class Conversation(Base):
     __tablename__ = "conversations"
-    id = sa.Column(sa.String(length=36), primary_key=True, default=gen_uuid)
+    id = sa.Column(UUIDString(), primary_key=True, default=gen_uuid)
     title = sa.Column(sa.String(length=255), nullable=True)
 
 class ConversationMember(Base):
     __tablename__ = "conversation_members"
-    conversation_id = sa.Column(sa.String(length=36), sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
-    user_id = sa.Column(sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    conversation_id = sa.Column(UUIDString(), sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    user_id = sa.Column(UUIDString(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        # "Which conversations is this user in": the primary key leads with
+        # conversation_id, so user_id lookups need their own index. The PK
+        # already covers (conversation_id, user_id) lookups.
+        sa.Index("ix_cm_user_conv", "user_id", "conversation_id", unique=True),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
-    id = sa.Column(sa.String(length=36), primary_key=True, default=gen_uuid)
+    id = sa.Column(UUIDString(), primary_key=True, default=gen_uuid)
     message_id = sa.Column(sa.String(length=255), nullable=False, unique=True, index=True)  # client-supplied UUID for idempotency
-    sender_id = sa.Column(sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
-    conversation_id = sa.Column(sa.String(length=36), sa.ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+    sender_id = sa.Column(UUIDString(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    conversation_id = sa.Column(UUIDString(), sa.ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     content = sa.Column(sa.Text(), nullable=False)
-    created_at = sa.Column(sa.DateTime(timezone=False), nullable=False, default=utc_now, index=True)
+    created_at = sa.Column(sa.DateTime(timezone=False), nullable=False, default=utc_now)
+
+    __table_args__ = (
+        # Conversation timeline: one range scan already in created_at order.
+        # Also serves plain conversation_id lookups (leading column).
+        sa.Index("ix_messages_conv_created", "conversation_id", "created_at"),
+    )
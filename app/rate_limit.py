@@ -3,17 +3,16 @@
 Rate limiting middleware for FastAPI.
 Supports rate limiting per user (authenticated) and per IP (unauthenticated).
 """
+import re
 import time
-from typing import Dict, Optional
-from collections import defaultdict
+from typing import Dict, List, Optional
 from fastapi import Request, HTTPException, status
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
-import asyncio
 
 
 class RateLimiter:
-    """Simple in-memory rate limiter using token bucket algorithm."""
+    """Simple in-memory rate limiter using sliding-window counters."""
 
     def __init__(self, requests_per_minute: int = 60, requests_per_hour: int = 1000):
         """
@@ -26,16 +25,33 @@ class RateLimiter:
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
 
-        # Store request timestamps: key -> list of timestamps
-        self.minute_buckets: Dict[str, list] = defaultdict(list)
-        self.hour_buckets: Dict[str, list] = defaultdict(list)
-        self._lock = None
-
-    def _get_lock(self):
-        """Lazy initialization of asyncio.Lock() - creates it when first needed in async context."""
-        if self._lock is None:
-            self._lock = asyncio.Lock()
-        return self._lock
+        # Sliding-window counters: key -> [minute_window, minute_count, minute_prev,
+        # hour_window, hour_count, hour_prev]. Constant memory per key; the
+        # previous window's count is weighted by how much of it still overlaps.
+        self.state: Dict[str, List[int]] = {}
+
+    @staticmethod
+    def _rotate(state: List[int], offset: int, window: int):
+        """Move a counter triple at state[offset:offset+3] forward to `window`."""
+        if window != state[offset]:
+            # Only the immediately preceding window still overlaps the sliding one
+            state[offset + 2] = state[offset + 1] if window == state[offset] + 1 else 0
+            state[offset + 1] = 0
+            state[offset] = window
+
+    @staticmethod
+    def _estimate(count: int, prev: int, now: float, size: int) -> float:
+        """Approximate requests in the last `size` seconds."""
+        return count + prev * ((size - now % size) / size)
+
+    def _current(self, key: str, now: float) -> List[int]:
+        state = self.state.get(key)
+        if state is None:
+            state = self.state[key] = [int(now // 60), 0, 0, int(now // 3600), 0, 0]
+        else:
+            self._rotate(state, 0, int(now // 60))
+            self._rotate(state, 3, int(now // 3600))
+        return state
 
     def _get_key(self, request: Request, user_id: Optional[str] = None) -> str:
         """
@@ -67,29 +83,29 @@ class RateLimiter:
             user_id: Authenticated user ID (if available)
 
         Returns:
-            Tuple of (is_allowed, error_message)
+            Tuple of (is_allowed, error_message, remaining_this_minute), all from
+            the same pass over the key's counters
         """
-        async with self._get_lock():
-            key = self._get_key(request, user_id)
-            now = time.time()
-
-            # Clean old entries (older than 1 hour)
-            self.hour_buckets[key] = [ts for ts in self.hour_buckets[key] if now - ts < 3600]
-            self.minute_buckets[key] = [ts for ts in self.minute_buckets[key] if now - ts < 60]
+        # No lock: nothing below awaits, so the check-and-append can't interleave
+        # with another request on the event loop
+        key = self._get_key(request, user_id)
+        now = time.time()
+        state = self._current(key, now)
 
-            # Check hourly limit
-            if len(self.hour_buckets[key]) >= self.requests_per_hour:
-                return False, f"Rate limit exceeded: {self.requests_per_hour} requests per hour"
+        # Check hourly limit
+        if self._estimate(state[4], state[5], now, 3600) >= self.requests_per_hour:
+            return False, f"Rate limit exceeded: {self.requests_per_hour} requests per hour", 0
 
-            # Check per-minute limit
-            if len(self.minute_buckets[key]) >= self.requests_per_minute:
-                return False, f"Rate limit exceeded: {self.requests_per_minute} requests per minute"
+        # Check per-minute limit
+        minute_used = self._estimate(state[1], state[2], now, 60)
+        if minute_used >= self.requests_per_minute:
+            return False, f"Rate limit exceeded: {self.requests_per_minute} requests per minute", 0
 
-            # Add current request
-            self.hour_buckets[key].append(now)
-            self.minute_buckets[key].append(now)
+        # Count current request
+        state[1] += 1
+        state[4] += 1
 
-            return True, None
+        return True, None, max(0, int(self.requests_per_minute - minute_used - 1))
 
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
@@ -107,18 +123,23 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         super().__init__(app)
         self.rate_limiter = rate_limiter
         self.exempt_paths = exempt_paths or ["/health", "/ready", "/metrics", "/docs", "/openapi.json", "/redoc"]
+        # One compiled prefix match instead of a startswith() per path per request.
+        # A prefix only matches whole path segments ("/docs", "/docs/...", not "/docsx").
+        self._exempt_re = re.compile(
+            "^(?:" + "|".join(re.escape(p.rstrip("/")) for p in self.exempt_paths) + ")(?:$|/)"
+        )
 
     async def dispatch(self, request: Request, call_next):
         """Process request with rate limiting."""
         # Skip rate limiting for exempt paths
-        if any(request.url.path.startswith(path) for path in self.exempt_paths):
+        if self._exempt_re.match(request.url.path):
             return await call_next(request)
 
         # Try to get user ID from request state (set by auth middleware if authenticated)
         user_id = getattr(request.state, "user_id", None)
 
         # Check rate limit
-        allowed, error_msg = await self.rate_limiter.is_allowed(request, user_id)
+        allowed, error_msg, remaining_minute = await self.rate_limiter.is_allowed(request, user_id)
 
         if not allowed:
             return Response(
@@ -134,11 +155,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
 
         response = await call_next(request)
 
-        # Add rate limit headers
-        key = self.rate_limiter._get_key(request, user_id)
-        remaining_minute = max(0, self.rate_limiter.requests_per_minute - len(self.rate_limiter.minute_buckets[key]))
-        remaining_hour = max(0, self.rate_limiter.requests_per_hour - len(self.rate_limiter.hour_buckets[key]))
-
+        # Add rate limit headers (remaining was computed by is_allowed above)
         response.headers["X-RateLimit-Limit"] = str(self.rate_limiter.requests_per_minute)
         response.headers["X-RateLimit-Remaining"] = str(remaining_minute)
         response.headers["X-RateLimit-Reset"] = str(int(time.time()) + 60)
@@ -1,13 +1,90 @@
 # app/routes.py
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi.responses import Response
+from pydantic import ValidationError
 from .schemas import ConversationCreate, MessageCreate
-from .store_sql import store
+from .models import is_uuid
+from .store_sql import store, MESSAGE_JSON_OPTIONS
+import os
+import json
 import asyncio
+import logging
+import orjson
 from .websockets import manager
 from .auth import get_current_user
 from .metrics import metrics
 
 router = APIRouter()
+logger = logging.getLogger("pneumatic")
+
+# In-flight broadcast tasks. Holding references keeps them from being garbage
+# collected mid-run; past the cap, post_message broadcasts inline instead of
+# spawning more (backpressure rather than unbounded task growth).
+MAX_BACKGROUND_BROADCASTS = int(os.environ.get("MAX_BACKGROUND_BROADCASTS", "1000"))
+_background_broadcasts = set()
+
+
+def _broadcast_done(task: asyncio.Task):
+    _background_broadcasts.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background broadcast failed: %s", task.exception())
+
+
+async def drain_background_broadcasts():
+    """
+    Wait for in-flight background broadcasts started on the running event loop,
+    so shutdown does not cancel them mid-query.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [t for t in _background_broadcasts if t.get_loop() is loop]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+_MESSAGE_CREATE_FIELDS = ("message_id", "sender_id", "conversation_id", "content")
+
+
+def _validation_error(errors: list) -> HTTPException:
+    """A 422 with the same body FastAPI's RequestValidationError handler renders."""
+    return HTTPException(status_code=422, detail=errors)
+
+
+def _parse_message_create(body: bytes) -> MessageCreate:
+    """
+    Decode and validate a MessageCreate body. The common case, four string
+    fields, is checked by hand and skips pydantic entirely. Anything else goes
+    through pydantic and the same steps FastAPI applies to a `m: MessageCreate`
+    body parameter, so coercion and the 422 body (loc/msg/type) are unchanged.
+    """
+    if not body:
+        raise _validation_error([{"loc": ["body"], "msg": "field required", "type": "value_error.missing"}])
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        # Report the error exactly as FastAPI does, from the stdlib decoder
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise _validation_error([{
+                "loc": ["body", e.pos],
+                "msg": str(e),
+                "type": "value_error.jsondecode",
+                "ctx": {"msg": e.msg, "doc": e.doc, "pos": e.pos, "lineno": e.lineno, "colno": e.colno},
+            }])
+    if not isinstance(data, dict):
+        raise _validation_error([{"loc": ["body"], "msg": "value is not a valid dict", "type": "type_error.dict"}])
+
+    if all(type(data.get(field)) is str for field in _MESSAGE_CREATE_FIELDS):
+        return MessageCreate.construct(
+            message_id=data["message_id"],
+            sender_id=data["sender_id"],
+            conversation_id=data["conversation_id"],
+            content=data["content"],
+        )
+    try:
+        return MessageCreate(**data)
+    except ValidationError as e:
+        raise _validation_error([{**err, "loc": ["body", *err["loc"]]} for err in e.errors()])
 
 @router.get("/users")
 async def list_users(
@@ -43,8 +120,12 @@ async def create_conversation(
     For 1-on-1 conversations (exactly 2 members), this will return an existing
     conversation if one already exists between these two users.
     """
+    malformed = [uid for uid in c.member_ids if not is_uuid(uid)]
+    if malformed:
+        raise HTTPException(status_code=400, detail=f"users do not exist: {malformed}")
+
     # Ensure current user is included in members
-    member_ids = list(set(c.member_ids + [current_user["id"]]))
+    member_ids = list({*c.member_ids, current_user["id"]})
 
     # Check if this is a 1-on-1 conversation (exactly 2 members)
     if len(member_ids) == 2:
@@ -73,8 +154,10 @@ async def get_messages(
     Get messages from a conversation.
     Requires authentication and membership in the conversation.
     """
-    # Verify user is a member of the conversation
-    conv = await store.get_conversation(conv_id)
+    # Verify user is a member of the conversation. Served from the store's
+    # conversation cache, so the message query is the request's only session.
+    # A malformed id names no conversation, so it never reaches the database.
+    conv = await store.get_conversation_cached(conv_id) if is_uuid(conv_id) else None
     if not conv:
         raise HTTPException(status_code=404, detail="conversation not found")
 
@@ -84,27 +167,46 @@ async def get_messages(
             detail="You are not a member of this conversation"
         )
 
-    try:
-        msgs = await store.list_messages(conv_id, limit=limit)
-        return {"messages": msgs}
-    except KeyError:
-        raise HTTPException(status_code=404, detail="conversation not found")
+    # One page, bounded by limit, read in full and encoded in a single orjson call
+    messages = await store.list_messages(conv_id, limit=limit)
+    return Response(
+        content=orjson.dumps({"messages": messages}, option=MESSAGE_JSON_OPTIONS),
+        media_type="application/json",
+    )
 
-@router.post("/messages", status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/messages",
+    status_code=status.HTTP_201_CREATED,
+    # The body is parsed by hand, so describe it for the OpenAPI docs explicitly
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": MessageCreate.schema()}},
+    }},
+)
 async def post_message(
-    m: MessageCreate,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Send a message to a conversation.
     Requires authentication. The sender_id must match the authenticated user.
     """
+    m = _parse_message_create(await request.body())
+
     # Enforce that sender_id matches authenticated user
     if m.sender_id != current_user["id"]:
         raise HTTPException(
             status_code=403,
             detail="sender_id must match authenticated user"
         )
+    if not is_uuid(m.message_id):
+        raise _validation_error([{
+            "loc": ["body", "message_id"],
+            "msg": "value is not a valid uuid",
+            "type": "type_error.uuid",
+        }])
+    if not is_uuid(m.conversation_id):
+        raise HTTPException(status_code=404, detail="conversation does not exist")
 
     try:
         saved = await store.save_message(m)
@@ -113,8 +215,17 @@ async def post_message(
     except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
 
-    payload = {"type": "message", "message": saved}
-    asyncio.create_task(manager.broadcast_to_conversation(m.conversation_id, payload))
+    # Encode the message once: the same bytes are the HTTP response body and,
+    # wrapped in the frame envelope, the text every recipient connection gets
+    body = orjson.dumps(saved)
+    frame = (b'{"type":"message","message":' + body + b"}").decode()
+    broadcast = manager.broadcast_text_to_conversation(m.conversation_id, frame)
+    if len(_background_broadcasts) < MAX_BACKGROUND_BROADCASTS:
+        task = asyncio.create_task(broadcast)
+        _background_broadcasts.add(task)
+        task.add_done_callback(_broadcast_done)
+    else:
+        await broadcast
     # Track message metric
     metrics.increment_message_sent()
-    return saved
+    return Response(content=body, status_code=status.HTTP_201_CREATED, media_type="application/json")
@@ -1,67 +1,179 @@
 # app/store_sql.py
 """Async SQLAlchemy data access layer."""
 from typing import Dict, Any, List, Optional
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update, insert, case, bindparam, exists, cast
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
+from cachetools import TTLCache
 from app.db import AsyncSessionLocal
-from app.models import User, Conversation, ConversationMember, Message
+from app.models import User, Conversation, ConversationMember, Message, gen_uuid
 from datetime import datetime, timezone
+import time
+import orjson
+
+# Column sets for read paths: plain Core rows, no ORM entity hydration
+_USER_COLUMNS = (User.id, User.username, User.full_name)
+_MESSAGE_COLUMNS = (
+    Message.id, Message.message_id, Message.sender_id,
+    Message.conversation_id, Message.content, Message.created_at,
+)
+
+
+# orjson options that render a naive UTC created_at exactly as
+# created_at.isoformat() + "Z" would, but in C
+MESSAGE_JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+# Hot-path statements, built once at import with bound parameters instead of
+# re-constructed per call; each also maps to a single compiled-cache entry.
+# A conversation with its members: one row per member (member NULL if none)
+_CONVERSATION_STMT = (
+    select(Conversation.id, Conversation.title, ConversationMember.user_id)
+    .outerjoin(ConversationMember, ConversationMember.conversation_id == Conversation.id)
+    .where(Conversation.id == bindparam("cid"))
+)
+_CONVERSATION_EXISTS_STMT = select(Conversation.id).where(Conversation.id == bindparam("cid"))
+_IS_MEMBER_STMT = select(ConversationMember.conversation_id).where(
+    ConversationMember.conversation_id == bindparam("cid"),
+    ConversationMember.user_id == bindparam("uid"),
+)
+_MESSAGE_INSERT_COLUMNS = ("id", "message_id", "sender_id", "conversation_id", "content", "created_at")
+# Newest `lim` messages: walk the (conversation_id, created_at) index
+# backwards from the tail, then restore chronological order in SQL
+_LATEST_MESSAGES = (
+    select(*_MESSAGE_COLUMNS)
+    .where(Message.conversation_id == bindparam("cid"))
+    .order_by(Message.created_at.desc())
+    .limit(bindparam("lim"))
+    .subquery()
+)
+_LATEST_MESSAGES_STMT = select(_LATEST_MESSAGES).order_by(_LATEST_MESSAGES.c.created_at.asc())
+
+
+def _message_dict(row) -> Dict[str, Any]:
+    m = dict(row._mapping)
+    m["created_at"] = m["created_at"].isoformat() + "Z"
+    return m
+
+
+# Conversations keyed by conv_id for the hot paths (broadcast fan-out, WS join)
+# that would otherwise hit the database per message. Missing conversations are
+# never cached. Entries are not invalidated on writes, so a membership change
+# (e.g. from another worker) can go unseen for up to the TTL below; that TTL
+# is the staleness bound.
+CONVERSATION_CACHE_TTL_SECONDS = 60
+
+# Whole-second part of the current UTC time, reformatted only when the second
+# changes: (epoch second, naive datetime, "YYYY-MM-DDTHH:MM:SS")
+_now_cache = (-1, None, "")
+
+
+def _utc_now_iso():
+    """
+    Current UTC time as (naive datetime, ISO-8601 string with "Z").
+    The column is timezone=False, so the datetime is naive UTC.
+    """
+    global _now_cache
+    sec, rem = divmod(time.time_ns(), 1_000_000_000)
+    if sec != _now_cache[0]:
+        base = datetime.fromtimestamp(sec, timezone.utc).replace(tzinfo=None)
+        _now_cache = (sec, base, base.strftime("%Y-%m-%dT%H:%M:%S"))
+    us = rem // 1000
+    return _now_cache[1].replace(microsecond=us), f"{_now_cache[2]}.{us:06d}Z"
+
+
+def _insert_ignore(session, model, index_elements=None):
+    """
+    INSERT ... ON CONFLICT DO NOTHING for the session's dialect, plain INSERT elsewhere.
+    index_elements limits the ignored conflicts to that unique key.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+    return insert(model)
+
+
+# Guarded message INSERT per dialect name, built on first use
+_message_inserts = {}
+
+
+def _member_message_insert(session):
+    """
+    INSERT a message only if its sender is a member; duplicate message_ids are ignored.
+    The row is a one-row SELECT over bound values that yields nothing unless a
+    membership row exists, so the check and the write are one statement.
+    """
+    dialect = session.bind.dialect.name
+    stmt = _message_inserts.get(dialect)
+    if stmt is None:
+        values = []
+        for c in _MESSAGE_INSERT_COLUMNS:
+            col_type = Message.__table__.c[c].type
+            value = bindparam(f"m_{c}", type_=col_type)
+            # PostgreSQL can't infer parameter types in a SELECT list; SQLite
+            # must not get CASTs (CAST AS DATETIME would coerce to a number)
+            values.append(cast(value, col_type) if dialect == "postgresql" else value)
+        row = select(*values).where(exists().where(
+            ConversationMember.conversation_id == bindparam("m_conversation_id"),
+            ConversationMember.user_id == bindparam("m_sender_id"),
+        ))
+        stmt = _insert_ignore(session, Message, index_elements=["message_id"]).from_select(
+            _MESSAGE_INSERT_COLUMNS, row
+        )
+        _message_inserts[dialect] = stmt
+    return stmt
+
 
 class SQLStore:
     def __init__(self):
-        pass
+        self._conv_cache: TTLCache = TTLCache(maxsize=10000, ttl=CONVERSATION_CACHE_TTL_SECONDS)
 
     # Users
     async def create_user(self, username: str, password_hash: str, full_name: Optional[str] = None) -> Dict[str, str]:
         """Create a new user with username, password hash, and optional full name."""
         async with AsyncSessionLocal() as session:
-            u = User(username=username, password_hash=password_hash, full_name=full_name)
-            session.add(u)
+            # Every column is known up front, so a plain INSERT is enough: no
+            # ORM unit of work and no SELECT after commit to reload the row
+            user = {"id": gen_uuid(), "username": username, "full_name": full_name}
             try:
+                await session.execute(insert(User).values(password_hash=password_hash, **user))
                 await session.commit()
-                await session.refresh(u)
-                return {"id": u.id, "username": u.username, "full_name": u.full_name}
+                return user
             except IntegrityError:
                 await session.rollback()
                 raise ValueError(f"Username '{username}' already exists")
 
+    async def update_password_hash(self, user_id: str, password_hash: str) -> None:
+        """Replace a user's stored password hash (e.g. after a parameter upgrade)."""
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(User).where(User.id == user_id).values(password_hash=password_hash))
+            await session.commit()
+
     async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
         async with AsyncSessionLocal() as session:
-            row = await session.get(User, user_id)
-            if row:
-                return {"id": row.id, "username": row.username, "full_name": row.full_name}
-            return None
+            q = await session.execute(select(*_USER_COLUMNS).where(User.id == user_id))
+            row = q.first()
+            return dict(row._mapping) if row else None
 
     async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user by username, including password hash for verification."""
         async with AsyncSessionLocal() as session:
-            q = await session.execute(select(User).where(User.username == username))
-            row = q.scalar_one_or_none()
-            if row:
-                return {
-                    "id": row.id,
-                    "username": row.username,
-                    "full_name": row.full_name,
-                    "password_hash": row.password_hash
-                }
-            return None
+            q = await session.execute(
+                select(*_USER_COLUMNS, User.password_hash).where(User.username == username)
+            )
+            row = q.first()
+            return dict(row._mapping) if row else None
 
     async def list_all_users(self, exclude_user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all users, optionally excluding a specific user."""
         async with AsyncSessionLocal() as session:
-            query = select(User)
+            query = select(*_USER_COLUMNS)
             if exclude_user_id:
                 query = query.where(User.id != exclude_user_id)
             q = await session.execute(query.order_by(User.username))
-            rows = q.scalars().all()
-            return [
-                {
-                    "id": row.id,
-                    "username": row.username,
-                    "full_name": row.full_name
-                }
-                for row in rows
-            ]
+            return [dict(row._mapping) for row in q.all()]
 
     async def find_one_on_one_conversation(self, user1_id: str, user2_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -69,48 +181,22 @@ class SQLStore:
         Returns None if no such conversation exists.
         """
         async with AsyncSessionLocal() as session:
-            # Find conversations where both users are members
-            # This query finds conversations that have exactly these two members
-
-            # Get all conversations where user1 is a member
-            q1 = await session.execute(
-                select(ConversationMember.conversation_id)
-                .where(ConversationMember.user_id == user1_id)
-            )
-            user1_conv_ids = {r[0] for r in q1.all()}
-
-            if not user1_conv_ids:
-                return None
-
-            # Get conversations where user2 is also a member
-            q2 = await session.execute(
-                select(ConversationMember.conversation_id)
-                .where(
-                    ConversationMember.conversation_id.in_(user1_conv_ids),
-                    ConversationMember.user_id == user2_id
-                )
+            # One statement: among user1's conversations, find one with exactly
+            # two members where one of them is user2
+            user1_convs = select(ConversationMember.conversation_id).where(ConversationMember.user_id == user1_id)
+            q = await session.execute(
+                select(Conversation.id, Conversation.title)
+                .join(ConversationMember, ConversationMember.conversation_id == Conversation.id)
+                .where(Conversation.id.in_(user1_convs))
+                .group_by(Conversation.id, Conversation.title)
+                .having(func.count() == 2)
+                .having(func.sum(case((ConversationMember.user_id == user2_id, 1), else_=0)) == 1)
+                .limit(1)
             )
-            shared_conv_ids = {r[0] for r in q2.all()}
-
-            if not shared_conv_ids:
+            row = q.first()
+            if row is None:
                 return None
-
-            # Check if any of these conversations have exactly 2 members (1-on-1)
-            for conv_id in shared_conv_ids:
-                q_members = await session.execute(
-                    select(func.count(ConversationMember.user_id))
-                    .where(ConversationMember.conversation_id == conv_id)
-                )
-                member_count = q_members.scalar()
-
-                if member_count == 2:
-                    # Found a 1-on-1 conversation
-                    conv = await session.get(Conversation, conv_id)
-                    if conv:
-                        members = [user1_id, user2_id]
-                        return {"id": conv.id, "title": conv.title, "members": members}
-
-            return None
+            return {"id": row.id, "title": row.title, "members": [user1_id, user2_id]}
 
     # Conversations
     async def create_conversation(self, title: str, member_ids: List[str]) -> Dict[str, Any]:
@@ -122,61 +208,61 @@ class SQLStore:
             if missing:
                 raise KeyError(f"users do not exist: {missing}")
 
-            conv = Conversation(title=title)
-            session.add(conv)
-            # flush to get conv.id
-            await session.flush()
-            conv_id = conv.id
-            # add members
-            for uid in member_ids:
-                cm = ConversationMember(conversation_id=conv_id, user_id=uid)
-                session.add(cm)
+            # The id is generated here, so no flush is needed to learn it, and
+            # all members go in as one executemany instead of one INSERT each.
+            # ON CONFLICT DO NOTHING makes a repeated member id harmless.
+            conv_id = gen_uuid()
+            await session.execute(insert(Conversation).values(id=conv_id, title=title))
+            await session.execute(
+                _insert_ignore(session, ConversationMember),
+                [{"conversation_id": conv_id, "user_id": uid} for uid in member_ids],
+            )
             await session.commit()
             return {"id": conv_id, "title": title, "members": member_ids}
 
     async def get_conversation(self, conv_id: str) -> Optional[Dict[str, Any]]:
         async with AsyncSessionLocal() as session:
-            conv = await session.get(Conversation, conv_id)
-            if not conv:
+            q = await session.execute(_CONVERSATION_STMT, {"cid": conv_id})
+            rows = q.all()
+            if not rows:
                 return None
-            q = await session.execute(select(ConversationMember.user_id).where(ConversationMember.conversation_id == conv_id))
-            members = [r[0] for r in q.all()]
-            return {"id": conv.id, "title": conv.title, "members": members}
+            # frozenset: callers only test membership and iterate, so make "in" O(1)
+            members = frozenset(r.user_id for r in rows if r.user_id is not None)
+            return {"id": rows[0].id, "title": rows[0].title, "members": members}
+
+    async def get_conversation_cached(self, conv_id: str) -> Optional[Dict[str, Any]]:
+        """get_conversation, served from the in-process conversation cache when possible."""
+        conv = self._conv_cache.get(conv_id)
+        if conv is None:
+            conv = await self.get_conversation(conv_id)
+            if conv is not None:
+                self._conv_cache[conv_id] = conv
+        return conv
+
+    def invalidate_conversation(self, conv_id: str) -> None:
+        """Drop a cached conversation so the next lookup hits the database."""
+        self._conv_cache.pop(conv_id, None)
 
     async def list_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all conversations for a user."""
         async with AsyncSessionLocal() as session:
-            # Get all conversation IDs where user is a member
+            # One query: every (conversation, member) pair for the user's
+            # conversations, grouped into member lists below
+            user_convs = select(ConversationMember.conversation_id).where(ConversationMember.user_id == user_id)
             q = await session.execute(
-                select(ConversationMember.conversation_id)
-                .where(ConversationMember.user_id == user_id)
+                select(Conversation.id, Conversation.title, ConversationMember.user_id)
+                .join(ConversationMember, ConversationMember.conversation_id == Conversation.id)
+                .where(Conversation.id.in_(user_convs))
             )
-            conv_ids = [r[0] for r in q.all()]
 
-            if not conv_ids:
-                return []
+            by_id: Dict[str, Dict[str, Any]] = {}
+            for conv_id, title, member_id in q.all():
+                conv = by_id.get(conv_id)
+                if conv is None:
+                    conv = by_id[conv_id] = {"id": conv_id, "title": title, "members": []}
+                conv["members"].append(member_id)
 
-            # Get conversation details
-            q = await session.execute(
-                select(Conversation).where(Conversation.id.in_(conv_ids))
-            )
-            conversations = q.scalars().all()
-
-            # Get members for each conversation
-            result = []
-            for conv in conversations:
-                q_members = await session.execute(
-                    select(ConversationMember.user_id)
-                    .where(ConversationMember.conversation_id == conv.id)
-                )
-                members = [r[0] for r in q_members.all()]
-                result.append({
-                    "id": conv.id,
-                    "title": conv.title,
-                    "members": members
-                })
-
-            return result
+            return list(by_id.values())
 
     # Messages
     async def save_message(self, message_payload) -> Dict[str, Any]:
@@ -185,77 +271,54 @@ class SQLStore:
           - message_id, sender_id, conversation_id, content
         Raises KeyError if conversation missing, PermissionError if sender not member.
         """
+        created_at_naive, created_at_iso = _utc_now_iso()
+        row = {
+            "id": gen_uuid(),
+            "message_id": message_payload.message_id,
+            "sender_id": message_payload.sender_id,
+            "conversation_id": message_payload.conversation_id,
+            "content": message_payload.content,
+            "created_at": created_at_naive,
+        }
+
         async with AsyncSessionLocal() as session:
-            # validate conversation
-            conv = await session.get(Conversation, message_payload.conversation_id)
-            if not conv:
-                raise KeyError("conversation does not exist")
-            # validate sender membership
-            q = await session.execute(select(ConversationMember).where(
-                ConversationMember.conversation_id == message_payload.conversation_id,
-                ConversationMember.user_id == message_payload.sender_id
-            ))
-            if not q.first():
-                raise PermissionError("sender is not a member of this conversation")
-
-            # Create message; rely on unique(message_id) to dedupe
-            # Convert timezone-aware datetime to naive for database compatibility
-            # The column is defined as timezone=False, so we need naive datetime
-            now_utc = datetime.now(timezone.utc)
-            created_at_naive = now_utc.replace(tzinfo=None) if now_utc.tzinfo else now_utc
-
-            msg = Message(
-                message_id=message_payload.message_id,
-                sender_id=message_payload.sender_id,
-                conversation_id=message_payload.conversation_id,
-                content=message_payload.content,
-                created_at=created_at_naive
+            # One round trip on the hot path: the INSERT itself checks membership
+            # (a membership row implies the conversation exists) and skips a
+            # duplicate message_id instead of aborting the transaction. Every
+            # value is known up front, so nothing is read back after commit.
+            result = await session.execute(
+                _member_message_insert(session), {f"m_{c}": v for c, v in row.items()}
             )
-            session.add(msg)
-            try:
-                await session.commit()
-                await session.refresh(msg)
-            except IntegrityError as e:
-                await session.rollback()
-                # likely duplicate message_id — return existing message
-                existing = await session.execute(select(Message).where(Message.message_id == message_payload.message_id))
-                row = existing.scalar_one_or_none()
-                if row:
-                    return {
-                        "id": row.id,
-                        "message_id": row.message_id,
-                        "sender_id": row.sender_id,
-                        "conversation_id": row.conversation_id,
-                        "content": row.content,
-                        "created_at": row.created_at.isoformat() + "Z"
-                    }
-                # else rethrow
-                raise
-            return {
-                "id": msg.id,
-                "message_id": msg.message_id,
-                "sender_id": msg.sender_id,
-                "conversation_id": msg.conversation_id,
-                "content": msg.content,
-                "created_at": msg.created_at.isoformat() + "Z"
-            }
+            await session.commit()
+            if result.rowcount == 0:
+                # Nothing inserted: work out why, membership first so a
+                # non-member can't read a message back by replaying its id
+                q = await session.execute(
+                    _IS_MEMBER_STMT,
+                    {"cid": message_payload.conversation_id, "uid": message_payload.sender_id},
+                )
+                if q.first() is None:
+                    q = await session.execute(_CONVERSATION_EXISTS_STMT, {"cid": message_payload.conversation_id})
+                    if q.first() is None:
+                        raise KeyError("conversation does not exist")
+                    raise PermissionError("sender is not a member of this conversation")
+                # duplicate message_id — return the message already stored
+                existing = await session.execute(
+                    select(*_MESSAGE_COLUMNS).where(Message.message_id == message_payload.message_id)
+                )
+                return _message_dict(existing.one())
+        row["created_at"] = created_at_iso
+        return row
 
     async def list_messages(self, conv_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        The newest `limit` messages of a conversation in chronological order.
+        created_at is left as a naive UTC datetime for orjson to format
+        (MESSAGE_JSON_OPTIONS) instead of being stringified per row here.
+        """
         async with AsyncSessionLocal() as session:
-            q = await session.execute(
-                select(Message).where(Message.conversation_id == conv_id).order_by(Message.created_at.asc()).limit(limit)
-            )
-            rows = q.scalars().all()
-            return [
-                {
-                    "id": r.id,
-                    "message_id": r.message_id,
-                    "sender_id": r.sender_id,
-                    "conversation_id": r.conversation_id,
-                    "content": r.content,
-                    "created_at": r.created_at.isoformat() + "Z"
-                } for r in rows
-            ]
+            result = await session.execute(_LATEST_MESSAGES_STMT, {"cid": conv_id, "lim": limit})
+            return [dict(r._mapping) for r in result]
 
 # create a single module-level store instance
 store = SQLStore()
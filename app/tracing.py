@@ -4,12 +4,35 @@ OpenTelemetry tracing configuration.
 """
 import os
 import sys
+import logging
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
+logger = logging.getLogger("pneumatic")
+
+
+def _span_exporter():
+    """
+    Pick the span exporter from the environment:
+    OTLP over gRPC when OTEL_EXPORTER_OTLP_ENDPOINT is set (needs the optional
+    opentelemetry-exporter-otlp-proto-grpc package), stdout when
+    TRACING_CONSOLE=1 (dev only), otherwise None.
+    """
+    if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        try:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-exporter-otlp-proto-grpc is not installed")
+            return None
+        # Endpoint, headers and TLS settings come from the standard OTEL_* variables
+        return OTLPSpanExporter()
+    if os.environ.get("TRACING_CONSOLE") == "1":
+        return ConsoleSpanExporter()
+    return None
+
 
 def setup_tracing(app, engine=None):
     """
@@ -23,6 +46,11 @@ def setup_tracing(app, engine=None):
     if "pytest" in sys.modules or os.environ.get("DISABLE_TRACING") == "1":
         return trace.get_tracer(__name__)
 
+    exporter = _span_exporter()
+    if exporter is None:
+        # Nowhere to send spans: don't pay for creating them on every request
+        return trace.get_tracer(__name__)
+
     try:
         # Create resource with service name
         resource = Resource.create({
@@ -34,9 +62,13 @@ def setup_tracing(app, engine=None):
         provider = TracerProvider(resource=resource)
         trace.set_tracer_provider(provider)
 
-        # Add console exporter (in production, use OTLP exporter)
-        console_exporter = ConsoleSpanExporter()
-        span_processor = BatchSpanProcessor(console_exporter)
+        # Export off the request path in large, infrequent batches
+        span_processor = BatchSpanProcessor(
+            exporter,
+            max_queue_size=4096,
+            schedule_delay_millis=2000,
+            max_export_batch_size=512,
+        )
         provider.add_span_processor(span_processor)
 
         # Instrument FastAPI
@@ -1,65 +1,152 @@
 # app/websockets.py
+import os
 import asyncio
-from typing import Dict, List
+from typing import Dict, FrozenSet, Set
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
 from .store_sql import store
 
+# Outbound frames buffered per connection before it is treated as too slow and dropped
+SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+# How long a graceful disconnect waits for the writer to flush queued frames
+CLOSE_FLUSH_TIMEOUT_SECONDS = 1.0
+
 
 class ConnectionManager:
     def __init__(self):
-        # Store multiple connections per user as a list
-        self.active: Dict[str, List[WebSocket]] = {}
-        self._lock = None
-
-    def _get_lock(self):
-        """Lazy initialization of asyncio.Lock() - creates it when first needed in async context."""
-        if self._lock is None:
-            self._lock = asyncio.Lock()
-        return self._lock
+        # Connections per user as an immutable frozenset: O(1) membership tests,
+        # and connect/disconnect swap in a new set while readers just take the
+        # current one. Every update is a synchronous read-modify-write with no
+        # await in between, so on a single event loop no lock is needed.
+        self.active: Dict[str, FrozenSet[WebSocket]] = {}
+        # Closes of dropped (too slow) connections, run in the background so the
+        # sender that overflowed them never waits on a close handshake
+        self._closing: Set[asyncio.Task] = set()
 
     async def connect(self, user_id: str, websocket: WebSocket):
         await websocket.accept()
-        async with self._get_lock():
-            if user_id not in self.active:
-                self.active[user_id] = []
-            self.active[user_id].append(websocket)
-
-    async def disconnect(self, user_id: str, websocket: WebSocket = None):
-        async with self._get_lock():
-            if user_id not in self.active:
+        # Each connection gets a bounded outbox drained by its own writer task,
+        # so a slow client only ever delays itself. Every outbound frame goes
+        # through it (see send_frame): one sender per socket, frames in order.
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        websocket.state.send_queue = queue
+        websocket.state.writer = asyncio.create_task(self._writer(user_id, websocket, queue))
+        self.active[user_id] = self.active.get(user_id, frozenset()) | {websocket}
+
+    async def _writer(self, user_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """
+        Drain a connection's outbox; drop the connection on the first failed send.
+        A None in the queue is the flush marker queued by disconnect.
+        """
+        while True:
+            text = await queue.get()
+            if text is None:
                 return
+            try:
+                await websocket.send_text(text)
+            except Exception:
+                break
+        await self.disconnect(user_id, websocket)
 
-            if websocket is None:
-                # Remove all connections for this user (backward compatibility)
-                connections = self.active.pop(user_id, [])
-                for ws in connections:
-                    try:
-                        await ws.close()
-                    except Exception:
-                        pass
-            else:
-                # Remove specific websocket connection
-                if websocket in self.active[user_id]:
-                    self.active[user_id].remove(websocket)
-                    try:
-                        await websocket.close()
-                    except Exception:
-                        pass
-                # Clean up empty lists
-                if not self.active[user_id]:
-                    del self.active[user_id]
-
-    async def send_personal(self, user_id: str, data: dict):
-        """Send data to all connections for a specific user"""
-        async with self._get_lock():
-            connections = self.active.get(user_id, [])
+    @staticmethod
+    async def _stop_writer(websocket: WebSocket, flush: bool):
+        """
+        Stop a connection's writer. With flush, frames already queued are sent
+        first (bounded by CLOSE_FLUSH_TIMEOUT_SECONDS); otherwise they are dropped.
+        """
+        writer = getattr(websocket.state, "writer", None)
+        if writer is None or writer.done() or writer is asyncio.current_task():
+            return
+        if flush:
+            try:
+                websocket.state.send_queue.put_nowait(None)
+                await asyncio.wait_for(writer, CLOSE_FLUSH_TIMEOUT_SECONDS)
+                return
+            except Exception:
+                pass
+        writer.cancel()
+        # Let the cancellation land so the close below never races a pending send
+        await asyncio.wait((writer,))
 
-        for ws in connections:
+    def _remove(self, user_id: str, websocket: WebSocket = None) -> tuple:
+        """
+        Drop connections from the map and return them (all of the user's when
+        websocket is None). Synchronous, so nothing sees a half-removed connection.
+        """
+        connections = self.active.get(user_id)
+        if connections is None:
+            return ()
+        if websocket is None:
+            # Remove all connections for this user (backward compatibility)
+            del self.active[user_id]
+            return tuple(connections)
+        if websocket not in connections:
+            return ()
+        remaining = connections - {websocket}
+        # Drop the key rather than leave an empty set behind
+        if remaining:
+            self.active[user_id] = remaining
+        else:
+            del self.active[user_id]
+        return (websocket,)
+
+    async def disconnect(self, user_id: str, websocket: WebSocket = None, flush: bool = True):
+        """
+        Remove and close a user's connection (or all of them when websocket is None).
+        A graceful disconnect flushes each outbox first; flush=False drops what is
+        still queued. Overflowing connections go through _drop instead.
+        """
+        # Update the map first; the closes below can then await freely
+        for ws in self._remove(user_id, websocket):
+            await self._stop_writer(ws, flush)
             try:
-                await ws.send_json(data)
+                await ws.close()
             except Exception:
                 pass
 
+    def _drop(self, user_id: str, websocket: WebSocket):
+        """
+        Disconnect a connection whose outbox overflowed without blocking the
+        caller: its transport is backed up, so closing it can take as long as the
+        close handshake timeout. Queued frames are discarded.
+        """
+        if not self._remove(user_id, websocket):
+            return
+        task = asyncio.create_task(self._close_dropped(websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_dropped(self, websocket: WebSocket):
+        await self._stop_writer(websocket, flush=False)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def _enqueue(self, targets, text: str):
+        """
+        Queue a frame on each (user_id, websocket) target without waiting on the network.
+        Connections whose outbox is full are dropped, their close left to the background.
+        """
+        for user_id, ws in targets:
+            try:
+                ws.state.send_queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._drop(user_id, ws)
+
+    async def send_frame(self, user_id: str, websocket: WebSocket, text: str):
+        """Queue an encoded frame for one connection, behind any frames already queued."""
+        await self._enqueue(((user_id, websocket),), text)
+
+    async def send_personal(self, user_id: str, data: dict):
+        """Send data to all connections for a specific user"""
+        # A snapshot: the set is never mutated, only replaced
+        connections = self.active.get(user_id, ())
+
+        # Encode once with orjson; every connection gets the same text frame
+        text = orjson.dumps(data).decode()
+        await self._enqueue([(user_id, ws) for ws in connections], text)
+
     async def broadcast_to_conversation(self, conv_id: str, data: dict):
         """
         Broadcast message to all members of a conversation.
@@ -68,32 +155,35 @@ class ConnectionManager:
             conv_id: Conversation ID
             data: Message data to broadcast
         """
+        await self.broadcast_text_to_conversation(conv_id, orjson.dumps(data).decode())
+
+    async def broadcast_text_to_conversation(self, conv_id: str, text: str):
+        """
+        Broadcast an already-encoded JSON frame to all members of a conversation.
+        Lets callers serialize once and reuse the frame for every recipient.
+
+        Args:
+            conv_id: Conversation ID
+            text: JSON-encoded message frame
+        """
         try:
-            conv = await store.get_conversation(conv_id)
+            conv = await store.get_conversation_cached(conv_id)
         except Exception:
             return
 
         if not conv:
             return
 
-        member_ids = conv.get("members") or []
-
-        # For each member, send to all their active websocket connections
-        async with self._get_lock():
-            # Create a snapshot of connections to avoid holding lock during sends
-            member_connections = {
-                member_id: list(self.active.get(member_id, []))
-                for member_id in member_ids
-            }
-
-        for member_id, ws_list in member_connections.items():
-            if not ws_list:
-                continue
-
-            for ws in ws_list:
-                try:
-                    await ws.send_json(data)
-                except Exception:
-                    pass
+        member_ids = conv.get("members") or ()
+
+        # For each member, queue the frame on all their active websocket connections
+        active = self.active
+        targets = [
+            (member_id, ws)
+            for member_id in member_ids
+            for ws in active.get(member_id, ())
+        ]
+
+        await self._enqueue(targets, text)
 
 manager = ConnectionManager()
\ No newline at end of file
@@ -0,0 +1,12 @@
+# app/workers.py
+"""Gunicorn worker classes for production."""
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    """
+    UvicornWorker pinned to uvloop and httptools.
+    The stock worker uses "auto", which silently falls back to the pure-Python
+    asyncio loop and h11 parser if either extension fails to import.
+    """
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
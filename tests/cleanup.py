@@ -5,29 +5,47 @@ Run this if pytest cleanup doesn't work properly.
 """
 import os
 import shutil
-import glob
+
+# Test database files (removed from the current directory only)
+TEST_DB_NAMES = {
+    "test.db",
+    "test.sqlite",
+    "test.sqlite3",
+    "pytest.db",
+    "pytest.sqlite",
+}
+TEST_DB_SUFFIXES = (".db-journal", ".sqlite-journal")
+
+# Python cache files (removed anywhere below the current directory)
+PY_CACHE_SUFFIXES = (".pyc", ".pyo", ".pyd")
+
+# Directories the walk never descends into
+SKIP_DIRS = {".git", ".venv", "venv", "__pycache__"}
+
+
+def _remove(filepath, quiet=False):
+    try:
+        os.remove(filepath)
+        if not quiet:
+            print(f"Removed: {filepath}")
+    except Exception as e:
+        if not quiet:
+            print(f"Could not remove {filepath}: {e}")
+
 
 def cleanup_test_files():
     """Remove all test-related files and directories."""
 
-    # Test database files
-    test_db_patterns = [
-        "test.db",
-        "test.sqlite",
-        "test.sqlite3",
-        "pytest.db",
-        "pytest.sqlite",
-        "*.db-journal",
-        "*.sqlite-journal",
-    ]
-
-    for pattern in test_db_patterns:
-        for file in glob.glob(pattern):
-            try:
-                os.remove(file)
-                print(f"Removed: {file}")
-            except Exception as e:
-                print(f"Could not remove {file}: {e}")
+    # One walk of the tree matches every file pattern, instead of a glob
+    # scan per pattern plus a separate walk for .pyc files
+    for root, dirs, files in os.walk("."):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        at_top = root == "."
+        for file in files:
+            if at_top and (file in TEST_DB_NAMES or file.endswith(TEST_DB_SUFFIXES)):
+                _remove(file)
+            elif file.endswith(PY_CACHE_SUFFIXES):
+                _remove(os.path.join(root, file), quiet=True)
 
     # Cache directories
     cache_dirs = [
@@ -51,21 +69,6 @@ def cleanup_test_files():
         except Exception as e:
             print(f"Could not remove {cache_dir}: {e}")
 
-    # Python cache files
-    for root, dirs, files in os.walk("."):
-        # Skip virtual environments
-        if ".venv" in root or "venv" in root or "__pycache__" in root:
-            continue
-
-        for file in files:
-            if file.endswith((".pyc", ".pyo", ".pyd")):
-                filepath = os.path.join(root, file)
-                try:
-                    os.remove(filepath)
-                    print(f"Removed: {filepath}")
-                except Exception:
-                    pass
-
     print("\nCleanup complete!")
 
 if __name__ == "__main__":
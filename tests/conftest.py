@@ -3,12 +3,37 @@
 Pytest configuration and fixtures for test cleanup.
 """
 import os
+import uuid
+import httpx
 import pytest
 import asyncio
+
+# Every TestClient request shares one client IP, so the whole suite draws on a
+# single rate-limit budget. Raise it before app.main (and its limiter) is imported.
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "10000")
+os.environ.setdefault("RATE_LIMIT_PER_HOUR", "100000")
+# Nearly every test signs up and logs in; production Argon2 cost (19 MiB, t=2)
+# only slows that down. The lowest cost argon2 allows keeps the real code path.
+os.environ.setdefault("ARGON2_MEMORY_KIB", "8")
+os.environ.setdefault("ARGON2_TIME_COST", "1")
+# Run against an in-memory SQLite database (no file, no fsync per commit). This
+# has to be set before app.db creates its engine, i.e. before the imports below;
+# the aiosqlite dialect serves :memory: from one StaticPool connection, so every
+# session and every TestClient request sees the same database.
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.models import Base
-from app.db import engine, AsyncSessionLocal
+from app.db import engine, init_db
+from app.store_sql import store
+from app.main import app
+from app.routes import drain_background_broadcasts
+from fastapi.testclient import TestClient
+from app.auth import get_password_hash, mint_token_pair
+
+# Password for every user made by the make_user fixture
+TEST_PASSWORD = "pass123"
 
 
 @pytest.fixture(scope="session")
@@ -19,6 +44,60 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture(scope="session", autouse=True)
+async def create_schema():
+    """
+    Create tables once per session, on the test event loop, so async tests
+    that never touch the TestClient (and its lifespan) still have a schema.
+    """
+    await init_db()
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    One TestClient shared by every test module. Entered as a context manager,
+    so all its requests run on one long-lived event loop: background tasks
+    (e.g. POST /messages broadcasts) are not cancelled when a request returns,
+    and the app's lifespan runs at the start and end of the session.
+    """
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+async def aclient():
+    """
+    httpx client calling the app in-process on the test's own event loop, for
+    async tests: no per-request event loop as with TestClient. WebSocket tests
+    still use the client fixture.
+    """
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.fixture(scope="session")
+async def test_password_hash():
+    """TEST_PASSWORD hashed once for the whole session."""
+    return await get_password_hash(TEST_PASSWORD)
+
+
+@pytest.fixture
+def make_user(test_password_hash):
+    """
+    Factory for authenticated test users: await make_user(prefix) -> (user, access_token).
+    Users are inserted through the store with a uuid-based username and get a
+    minted token, skipping the /auth/signup + /auth/login round trips; tests of
+    those endpoints still call them directly. Works from any async test, whether
+    it then talks to the app through client or aclient.
+    """
+    async def make(prefix: str = "user"):
+        user = await store.create_user(f"{prefix}_{uuid.uuid4().hex[:12]}", test_password_hash)
+        access_token, _ = mint_token_pair(user["id"])
+        return user, access_token
+    return make
+
+
 @pytest.fixture(scope="function", autouse=True)
 async def cleanup_database():
     """
@@ -32,19 +111,36 @@ async def cleanup_database():
     from app.db import DATABASE_URL
     if ":memory:" not in DATABASE_URL:
         try:
-            from sqlalchemy import text
-            async with AsyncSessionLocal() as session:
-                # Delete in reverse order of dependencies
-                await session.execute(text("DELETE FROM messages"))
-                await session.execute(text("DELETE FROM conversation_members"))
-                await session.execute(text("DELETE FROM conversations"))
-                await session.execute(text("DELETE FROM users"))
-                await session.commit()
+            # Children before parents, straight from the model metadata
+            deletes = [f"DELETE FROM {t.name}" for t in reversed(Base.metadata.sorted_tables)]
+            async with engine.connect() as conn:
+                if conn.dialect.name == "sqlite":
+                    # One executescript call runs every DELETE in a single
+                    # driver round trip instead of one per table
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.executescript(
+                        "BEGIN; " + "; ".join(deletes) + "; COMMIT;"
+                    )
+                else:
+                    async with conn.begin():
+                        for stmt in deletes:
+                            await conn.exec_driver_sql(stmt)
         except Exception:
             # If cleanup fails, continue (database might not exist or be in use)
             pass
 
 
+@pytest.fixture(autouse=True)
+async def drain_broadcasts(client, cleanup_database):
+    """
+    Finish each test's background broadcasts before the next test starts (and
+    before cleanup_database, which this fixture is torn down ahead of).
+    """
+    yield
+    await drain_background_broadcasts()  # started by aclient, on the test loop
+    client.portal.call(drain_background_broadcasts)  # started through client
+
+
 @pytest.fixture(scope="session", autouse=True)
 def cleanup_test_files():
     """
@@ -88,10 +184,6 @@ def set_test_environment():
     """
     Set test environment variables before tests run.
     """
-    # Use in-memory SQLite for tests if DATABASE_URL not set
-    if "DATABASE_URL" not in os.environ:
-        os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
-
     # Disable tracing during tests
     os.environ["DISABLE_TRACING"] = "1"
 
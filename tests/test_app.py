@@ -1,13 +1,19 @@
 # tests/test_app.py
 import json
+import uuid
+import asyncio
+from types import SimpleNamespace
+from fastapi import FastAPI, Request
 from fastapi.testclient import TestClient
 from app.main import app
-import uuid
-
-client = TestClient(app)
+from app import routes
+from app.schemas import MessageCreate
+from app.store_sql import store
+from app import websockets as websockets_module
+from app.websockets import ConnectionManager
 
 
-def test_root_serves_index():
+def test_root_serves_index(client):
     """Test that root route serves index.html"""
     response = client.get("/")
     assert response.status_code == 200
@@ -15,7 +21,7 @@ def test_root_serves_index():
     assert "Pneumatic Chat" in response.text or "Login" in response.text
 
 
-def test_health_check():
+def test_health_check(client):
     """Test health check endpoint"""
     response = client.get("/health")
     assert response.status_code == 200
@@ -23,7 +29,7 @@ def test_health_check():
     assert data["status"] == "healthy"
 
 
-def test_readiness_check():
+def test_readiness_check(client):
     """Test readiness check endpoint"""
     response = client.get("/ready")
     assert response.status_code == 200
@@ -31,7 +37,7 @@ def test_readiness_check():
     assert data["status"] == "ready"
 
 
-def test_metrics_endpoint():
+def test_metrics_endpoint(client):
     """Test Prometheus metrics endpoint"""
     response = client.get("/metrics")
     assert response.status_code == 200
@@ -49,7 +55,7 @@ def test_metrics_endpoint():
     assert "# TYPE" in metrics_text
 
 
-def test_rate_limiting():
+def test_rate_limiting(client):
     """Test rate limiting middleware"""
     # Test that exempt endpoints don't have rate limit headers
     health_response = client.get("/health")
@@ -70,7 +76,7 @@ def test_rate_limiting():
     assert int(response.headers["X-RateLimit-Remaining"]) >= 0
 
 
-def test_static_files_served():
+def test_static_files_served(client):
     """Test that static files are accessible"""
     # Test index.html
     response = client.get("/static/index.html")
@@ -83,22 +89,10 @@ def test_static_files_served():
     assert "text/html" in response.headers["content-type"]
 
 
-def test_create_user_and_conv_and_send_http_message():
-    # create two users with authentication (use unique usernames)
-    import time
-    unique_id = str(int(time.time() * 1000))
-    r = client.post("/auth/signup", json={"username": f"alice_{unique_id}", "password": "pass123"})
-    assert r.status_code == 201, f"Signup failed: {r.json()}"
-    alice = r.json()
-
-    r = client.post("/auth/signup", json={"username": f"bob_{unique_id}", "password": "pass123"})
-    assert r.status_code == 201, f"Signup failed: {r.json()}"
-    bob = r.json()
-
-    # login as alice to get token
-    login = client.post("/auth/login", json={"username": f"alice_{unique_id}", "password": "pass123"})
-    assert login.status_code == 200
-    alice_token = login.json()["access_token"]
+async def test_create_user_and_conv_and_send_http_message(client, make_user):
+    # create two authenticated users
+    alice, alice_token = await make_user("alice")
+    bob, _ = await make_user("bob")
 
     # create conversation (requires auth)
     r = client.post(
@@ -122,6 +116,20 @@ def test_create_user_and_conv_and_send_http_message():
     saved = r.json()
     assert saved["content"] == "hello bob"
 
+    # malformed bodies are rejected before touching the store
+    bad = dict(payload, content=["not", "a", "string"])
+    r = client.post("/messages", json=bad, headers={"Authorization": f"Bearer {alice_token}"})
+    assert r.status_code == 422
+    assert r.json()["detail"] == [
+        {"loc": ["body", "content"], "msg": "str type expected", "type": "type_error.str"}
+    ]
+    bad = {k: v for k, v in payload.items() if k != "content"}
+    r = client.post("/messages", json=bad, headers={"Authorization": f"Bearer {alice_token}"})
+    assert r.status_code == 422
+    assert r.json()["detail"] == [
+        {"loc": ["body", "content"], "msg": "field required", "type": "value_error.missing"}
+    ]
+
     # fetching messages (requires auth)
     r = client.get(f"/conversations/{conv['id']}/messages", headers={"Authorization": f"Bearer {alice_token}"})
     assert r.status_code == 200
@@ -129,23 +137,160 @@ def test_create_user_and_conv_and_send_http_message():
     assert any(m["message_id"] == msg_id for m in messages)
 
 
-def test_websocket_send_and_receive():
-    # create users with authentication (use unique usernames)
-    import time
-    unique_id = str(int(time.time() * 1000))
-    r = client.post("/auth/signup", json={"username": f"w1_{unique_id}", "password": "pass123"})
-    assert r.status_code == 201, f"Signup failed: {r.json()}"
-    u1 = r.json()
-    r = client.post("/auth/signup", json={"username": f"w2_{unique_id}", "password": "pass123"})
-    assert r.status_code == 201, f"Signup failed: {r.json()}"
-    u2 = r.json()
+def test_message_body_validation_matches_pydantic_body_param():
+    """POST /messages bodies are accepted and rejected exactly as a `m: MessageCreate` parameter would be."""
+    reference = FastAPI()
+
+    @reference.post("/pydantic")
+    async def pydantic_body(m: MessageCreate):
+        return m.dict()
+
+    @reference.post("/by-hand")
+    async def by_hand(request: Request):
+        return routes._parse_message_create(await request.body()).dict()
+
+    ref_client = TestClient(reference)
+    valid = {"message_id": "m", "sender_id": "s", "conversation_id": "c", "content": "hi"}
+    bodies = [
+        valid,
+        dict(valid, content=5),
+        dict(valid, content=None),
+        dict(valid, content=["x"]),
+        {k: v for k, v in valid.items() if k != "content"},
+        {},
+        ["not", "an", "object"],
+        "string",
+    ]
+    for body in bodies:
+        expected = ref_client.post("/pydantic", json=body)
+        actual = ref_client.post("/by-hand", json=body)
+        assert (actual.status_code, actual.json()) == (expected.status_code, expected.json()), body
+
+    for raw in (b"", b"{not json", b'{"content": "hi",}'):
+        headers = {"content-type": "application/json"}
+        expected = ref_client.post("/pydantic", content=raw, headers=headers)
+        actual = ref_client.post("/by-hand", content=raw, headers=headers)
+        assert (actual.status_code, actual.json()) == (expected.status_code, expected.json()), raw
+
+
+async def test_get_messages_returns_latest_page_in_order(client, make_user):
+    user, token = await make_user("pager")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    r = client.post("/conversations", json={"title": "notes", "member_ids": []}, headers=headers)
+    assert r.status_code == 201
+    conv = r.json()
+
+    for content in ("first", "second", "third"):
+        r = client.post(
+            "/messages",
+            json={
+                "message_id": str(uuid.uuid4()),
+                "sender_id": user["id"],
+                "conversation_id": conv["id"],
+                "content": content,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 201
+
+    r = client.get(f"/conversations/{conv['id']}/messages?limit=2", headers=headers)
+    assert r.status_code == 200
+    assert [m["content"] for m in r.json()["messages"]] == ["second", "third"]
+
+
+async def test_get_messages_database_error_is_a_500(client, make_user, monkeypatch):
+    user, token = await make_user("dberr")
+    headers = {"Authorization": f"Bearer {token}"}
+    conv = client.post("/conversations", json={"title": "x", "member_ids": []}, headers=headers).json()
+
+    async def failing_list(conv_id, limit=50):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(store, "list_messages", failing_list)
+    # a database failure must surface as a 500, not a partial 200
+    r = TestClient(app, raise_server_exceptions=False).get(
+        f"/conversations/{conv['id']}/messages", headers=headers
+    )
+    assert r.status_code == 500
+
+
+async def test_malformed_ids_are_rejected_before_the_database(client, make_user):
+    user, token = await make_user("badids")
+    headers = {"Authorization": f"Bearer {token}"}
+    conv = client.post("/conversations", json={"title": "x", "member_ids": []}, headers=headers).json()
+    message = {"message_id": str(uuid.uuid4()), "sender_id": user["id"], "conversation_id": conv["id"], "content": "hi"}
+
+    r = client.post("/messages", json=dict(message, message_id="not-a-uuid"), headers=headers)
+    assert r.status_code == 422
+    assert r.json()["detail"][0]["loc"] == ["body", "message_id"]
+
+    r = client.post("/messages", json=dict(message, conversation_id="not-a-uuid"), headers=headers)
+    assert r.status_code == 404
+
+    r = client.get("/conversations/not-a-uuid/messages", headers=headers)
+    assert r.status_code == 404
+
+    r = client.post("/conversations", json={"title": "x", "member_ids": ["not-a-uuid"]}, headers=headers)
+    assert r.status_code == 400
+
+
+async def test_post_message_is_idempotent_on_message_id(client, make_user):
+    user, token = await make_user("dedup")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    r = client.post("/conversations", json={"title": "retries", "member_ids": []}, headers=headers)
+    assert r.status_code == 201
+    conv = r.json()
+
+    payload = {
+        "message_id": str(uuid.uuid4()),
+        "sender_id": user["id"],
+        "conversation_id": conv["id"],
+        "content": "sent twice",
+    }
+    first = client.post("/messages", json=payload, headers=headers)
+    assert first.status_code == 201
+    retry = client.post("/messages", json=payload, headers=headers)
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+
+    r = client.get(f"/conversations/{conv['id']}/messages", headers=headers)
+    assert [m["content"] for m in r.json()["messages"]] == ["sent twice"]
+
+
+async def test_post_message_rejects_non_member_and_unknown_conversation(client, make_user):
+    tokens = {}
+    users = {}
+    for name in ("owner", "outsider"):
+        users[name], token = await make_user(name)
+        tokens[name] = {"Authorization": f"Bearer {token}"}
+
+    r = client.post("/conversations", json={"title": "private", "member_ids": []}, headers=tokens["owner"])
+    assert r.status_code == 201
+    conv = r.json()
+
+    payload = {
+        "message_id": str(uuid.uuid4()),
+        "sender_id": users["outsider"]["id"],
+        "conversation_id": conv["id"],
+        "content": "let me in",
+    }
+    r = client.post("/messages", json=payload, headers=tokens["outsider"])
+    assert r.status_code == 403
+
+    payload["conversation_id"] = str(uuid.uuid4())
+    r = client.post("/messages", json=payload, headers=tokens["outsider"])
+    assert r.status_code == 404
+
+    r = client.get(f"/conversations/{conv['id']}/messages", headers=tokens["owner"])
+    assert r.json()["messages"] == []
 
-    # login to get tokens
-    login1 = client.post("/auth/login", json={"username": f"w1_{unique_id}", "password": "pass123"})
-    token1 = login1.json()["access_token"]
 
-    login2 = client.post("/auth/login", json={"username": f"w2_{unique_id}", "password": "pass123"})
-    token2 = login2.json()["access_token"]
+async def test_websocket_send_and_receive(client, make_user):
+    # create authenticated users
+    u1, token1 = await make_user("w1")
+    u2, token2 = await make_user("w2")
 
     # create conversation (requires auth)
     r = client.post(
@@ -176,3 +321,171 @@ def test_websocket_send_and_receive():
         assert data2["type"] == "message"
         assert data1["message"]["message_id"] == msg_id
         assert data2["message"]["message_id"] == msg_id
+
+
+async def test_websocket_rejects_invalid_message_shape(client, make_user):
+    _, token = await make_user("shape")
+
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        # missing "content"
+        ws.send_json({"type": "message", "message_id": str(uuid.uuid4()), "conversation_id": "c1"})
+        data = ws.receive_json()
+        assert data == {"type": "error", "reason": "invalid message shape"}
+
+        # non-string field
+        ws.send_json({"type": "message", "message_id": str(uuid.uuid4()), "conversation_id": "c1", "content": 42})
+        data = ws.receive_json()
+        assert data == {"type": "error", "reason": "invalid message shape"}
+
+        ws.send_json({"type": "bogus"})
+        data = ws.receive_json()
+        assert data == {"type": "error", "reason": "unknown type"}
+
+
+async def test_websocket_frames_arrive_in_send_order(client, make_user):
+    user, token = await make_user("order")
+    r = client.post(
+        "/conversations",
+        json={"title": "order", "member_ids": []},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    conv = r.json()
+
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        ws.send_json({"type": "join", "conversation_id": conv["id"]})
+        # the message echo is queued before the error for the frame after it
+        ws.send_json({"type": "message", "message_id": str(uuid.uuid4()), "conversation_id": conv["id"], "content": "first"})
+        ws.send_json({"type": "bogus"})
+        assert ws.receive_json()["type"] == "joined"
+        assert ws.receive_json()["message"]["content"] == "first"
+        assert ws.receive_json() == {"type": "error", "reason": "unknown type"}
+
+
+class _RecordingWebSocket:
+    """Just enough of a WebSocket for ConnectionManager: records what is sent."""
+
+    def __init__(self):
+        self.state = SimpleNamespace()
+        self.sent = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        assert not self.closed
+        self.sent.append(text)
+
+    async def close(self):
+        self.closed = True
+
+
+async def test_disconnect_flushes_queued_frames():
+    manager = ConnectionManager()
+    ws = _RecordingWebSocket()
+    await manager.connect("u1", ws)
+    for text in ("a", "b", "c"):
+        await manager.send_frame("u1", ws, text)
+
+    await manager.disconnect("u1", ws)
+    assert ws.sent == ["a", "b", "c"]
+    assert ws.closed
+    assert "u1" not in manager.active
+
+
+async def _post_and_receive(client, make_user, content):
+    """POST a message while a member listens on a WebSocket; return the frame it gets."""
+    user, token = await make_user("bg")
+    headers = {"Authorization": f"Bearer {token}"}
+    conv = client.post("/conversations", json={"title": "bg", "member_ids": []}, headers=headers).json()
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        ws.send_json({"type": "join", "conversation_id": conv["id"]})
+        assert ws.receive_json()["type"] == "joined"
+        r = client.post(
+            "/messages",
+            json={
+                "message_id": str(uuid.uuid4()),
+                "sender_id": user["id"],
+                "conversation_id": conv["id"],
+                "content": content,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 201
+        return ws.receive_json()
+
+
+async def test_post_message_broadcasts_in_background_task(client, make_user):
+    assert routes.MAX_BACKGROUND_BROADCASTS > 0
+    frame = await _post_and_receive(client, make_user, "via task")
+    assert frame["message"]["content"] == "via task"
+
+    client.portal.call(routes.drain_background_broadcasts)
+    assert not routes._background_broadcasts
+
+
+async def test_post_message_broadcasts_inline_at_cap(client, make_user, monkeypatch):
+    monkeypatch.setattr(routes, "MAX_BACKGROUND_BROADCASTS", 0)
+    frame = await _post_and_receive(client, make_user, "inline")
+    assert frame["message"]["content"] == "inline"
+    assert not routes._background_broadcasts
+
+
+async def test_failed_background_broadcast_is_logged_and_dropped(client, make_user, monkeypatch, caplog):
+    async def failing_broadcast(conv_id, text):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(routes.manager, "broadcast_text_to_conversation", failing_broadcast)
+    user, token = await make_user("bgfail")
+    headers = {"Authorization": f"Bearer {token}"}
+    conv = client.post("/conversations", json={"title": "bg", "member_ids": []}, headers=headers).json()
+    r = client.post(
+        "/messages",
+        json={
+            "message_id": str(uuid.uuid4()),
+            "sender_id": user["id"],
+            "conversation_id": conv["id"],
+            "content": "lost",
+        },
+        headers=headers,
+    )
+    assert r.status_code == 201
+
+    client.portal.call(routes.drain_background_broadcasts)
+    assert not routes._background_broadcasts
+    assert "Background broadcast failed: boom" in caplog.text
+
+
+class _StalledWebSocket(_RecordingWebSocket):
+    """A client that never reads: sends and the close handshake both hang."""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.unblock.wait()
+
+    async def close(self):
+        await self.unblock.wait()
+        self.closed = True
+
+
+async def test_overflowing_connection_is_dropped_without_waiting_on_close(monkeypatch):
+    monkeypatch.setattr(websockets_module, "SEND_QUEUE_SIZE", 1)
+    manager = ConnectionManager()
+    ws = _StalledWebSocket()
+    await manager.connect("slow", ws)
+    await manager.send_frame("slow", ws, "a")
+    await asyncio.sleep(0)  # writer takes "a" and stalls in send_text
+    await manager.send_frame("slow", ws, "b")
+
+    # the overflowing send returns at once even though close() cannot finish
+    await asyncio.wait_for(manager.send_frame("slow", ws, "c"), timeout=0.5)
+    assert "slow" not in manager.active
+    assert not ws.closed
+
+    ws.unblock.set()
+    await asyncio.gather(*manager._closing)
+    assert ws.closed
+    assert ws.state.writer.cancelled()